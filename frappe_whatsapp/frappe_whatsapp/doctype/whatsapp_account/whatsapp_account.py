@@ -9,6 +9,12 @@ class WhatsAppAccount(Document):
 	def on_update(self):
 		"""Check there is only one default of each type."""
 		self.there_must_be_only_one_default()
+		# Drop the webhook's phone_id -> account resolution cache
+		frappe.cache().delete_value("whatsapp_account_by_phone")
+
+	def on_trash(self):
+		"""Deleted accounts must not linger in the resolution cache."""
+		frappe.cache().delete_value("whatsapp_account_by_phone")
 
 	def there_must_be_only_one_default(self):
 		"""If current WhatsApp Account is default, un-default all other accounts."""
@@ -1,12 +1,17 @@
 """Notification."""
 
 import json
+import re
+from collections import deque
+from types import SimpleNamespace
+
 import frappe
 
+from RestrictedPython import compile_restricted
+
 from frappe import _dict, _
 from frappe.model.document import Document
-from frappe.utils.safe_exec import get_safe_globals, safe_exec
-from frappe.integrations.utils import make_post_request
+from frappe.utils.safe_exec import FrappeTransformer, get_safe_globals, safe_exec
 from frappe.desk.form.utils import get_pdf_link
 from frappe.utils import (
     add_to_date, nowdate, datetime,
@@ -14,7 +19,83 @@ from frappe.utils import (
     get_datetime, get_time, now_datetime, now
 )
 
-from frappe_whatsapp.utils import get_whatsapp_account
+from frappe_whatsapp.utils import get_whatsapp_account, make_whatsapp_request
+
+
+# Commonly used frappe.utils functions exposed to Expression fields.
+# RestrictedPython blocks attribute access on modules, so expressions like
+# frappe.utils.format_date(...) need a plain namespace instead of the module.
+_UTILS_OBJ = SimpleNamespace(
+    format_date=format_date,
+    format_time=format_time,
+    format_datetime=format_datetime,
+    get_datetime=get_datetime,
+    get_time=get_time,
+    now_datetime=now_datetime,
+    now=now,
+    add_to_date=add_to_date,
+)
+
+
+def _make_frappe_obj():
+    """Build the restricted frappe proxy used by Expression fields.
+
+    frappe.db and frappe.session are request-locals, so this is rebuilt per
+    send instead of cached at import time.
+    """
+    return SimpleNamespace(
+        utils=_UTILS_OBJ,
+        db=frappe.db,
+        get_doc=frappe.get_doc,
+        get_value=frappe.get_value,
+        get_list=frappe.get_list,
+        session=frappe.session,
+    )
+
+
+# Documents per background job when fanning out daily sends
+SEND_BATCH_SIZE = 20
+
+# Field types whose raw value differs from its display formatting (the
+# set frappe.format_value actually transforms); only these are worth a
+# get_formatted call in the parameter loop.
+_FORMATTED_FIELDTYPES = {
+    "Date", "Datetime", "Time", "Duration",
+    "Currency", "Float", "Int", "Percent",
+}
+
+# Compiled Expression field code objects keyed by expression source.
+# Tiny expressions are dominated by parse/transform cost, so compile the
+# restricted code once and reuse it across notification sends.
+_EXPR_CODE_CACHE = {}
+
+
+def _compile_expression(expression):
+    """Return restricted code for an Expression field, compiled in eval mode.
+
+    Eval mode skips the ``result =`` wrapper and the locals write-back.
+    Returns None when the source does not compile as a single expression;
+    the caller falls back to safe_exec for those.
+    """
+    code = _EXPR_CODE_CACHE.get(expression, False)
+    if code is False:
+        try:
+            code = compile_restricted(
+                expression,
+                filename="<whatsapp_notification>",
+                mode="eval",
+                policy=FrappeTransformer,
+            )
+        except SyntaxError:
+            code = None
+        _EXPR_CODE_CACHE[expression] = code
+    return code
+
+
+# Replace newlines and tabs with a single space in one translate pass
+_WS_TRANS = str.maketrans({'\n': ' ', '\r': ' ', '\t': ' '})
+# Collapse runs of spaces to max 4 consecutive spaces
+_MULTISPACE_RE = re.compile(r' {5,}')
 
 
 def sanitize_whatsapp_param(value):
@@ -22,18 +103,12 @@ def sanitize_whatsapp_param(value):
     Sanitize text for WhatsApp template parameters.
     WhatsApp API rejects: newlines, tabs, more than 4 consecutive spaces, empty strings.
     """
-    import re
     if value in (None, ""):
         return "-"
-    
-    text = str(value)
-    # Replace newlines and tabs with single space
-    text = text.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
-    # Collapse multiple spaces to max 4 consecutive spaces
-    text = re.sub(r' {5,}', '    ', text)
-    # Strip leading/trailing whitespace
-    text = text.strip()
-    
+
+    text = str(value).translate(_WS_TRANS)
+    text = _MULTISPACE_RE.sub('    ', text).strip()
+
     if not text:
         return "-"
     return text
@@ -42,66 +117,61 @@ def sanitize_whatsapp_param(value):
 class WhatsAppNotification(Document):
     """Notification."""
 
+    def get_cached_meta(self, doctype):
+        """Memoize frappe.get_meta per doctype for the life of this notification."""
+        cache = getattr(self, "_doctype_meta", None)
+        if cache is None:
+            cache = self._doctype_meta = {}
+        meta = cache.get(doctype)
+        if meta is None:
+            meta = cache[doctype] = frappe.get_meta(doctype)
+        return meta
+
     def get_value_from_path(self, doc, path):
         """Resolve dotted path like 'user.mobile_no' from doc."""
         if not path:
             return None
-        
+
         parts = path.split(".")
         value = doc
-        
+
         for part in parts:
             if value is None:
                 return None
-                
+
             if isinstance(value, Document):
-                if hasattr(value, part):
-                    # Try get() first (for regular fields)
-                    link_value = value.get(part)
-                    
-                    # If get() returns None and it's not a field, try getattr() for properties
-                    if link_value is None:
-                        try:
-                            meta = frappe.get_meta(value.doctype)
-                            df = meta.get_field(part)
-                            # If it's not a field in meta, it might be a property
-                            if not df:
-                                link_value = getattr(value, part, None)
-                        except Exception:
-                            # Fallback: try getattr if get() returned None
-                            link_value = getattr(value, part, None)
-                    
-                    # Check if this is a Link field pointing to another doctype
+                if not hasattr(value, part):
+                    return None
+
+                # Real fields come from get(); anything else is a property
+                df = self.get_cached_meta(value.doctype).get_field(part)
+                link_value = value.get(part) if df else getattr(value, part, None)
+
+                # Follow Link fields into the target document; dangling
+                # links degrade to the raw value instead of aborting the
+                # triggering save
+                if df and df.fieldtype == "Link" and link_value:
                     try:
-                        meta = frappe.get_meta(value.doctype)
-                        df = meta.get_field(part)
-                        if df and df.fieldtype == "Link" and link_value:
-                            value = frappe.get_doc(df.options, link_value)
-                        else:
-                            value = link_value
-                    except Exception:
+                        value = frappe.get_cached_doc(df.options, link_value)
+                    except frappe.DoesNotExistError:
+                        frappe.clear_last_message()
                         value = link_value
                 else:
-                    return None
+                    value = link_value
             elif isinstance(value, dict):
                 value = value.get(part)
             else:
                 return None
-                
+
         return value
 
     def validate(self):
         """Validate."""
         if self.notification_type == "DocType Event" and self.field_name:
-            # For dotted paths, only validate the first part exists as a field
+            # For dotted paths, only validate the first part exists as a field.
+            # Meta already includes Custom Fields, so one has_field check covers both.
             first_field = self.field_name.split(".")[0]
-            fields = frappe.get_doc("DocType", self.reference_doctype).fields
-            fields += frappe.get_all(
-                "Custom Field",
-                filters={"dt": self.reference_doctype},
-                fields=["fieldname"]
-            )
-            if not any(field.fieldname == first_field for field in fields): # noqa
+            if not self.get_cached_meta(self.reference_doctype).has_field(first_field):
                 frappe.throw(_("Field name {0} does not exist on DocType {1}").format(first_field, self.reference_doctype))
         if self.custom_attachment:
             if not self.attach and not self.attach_from_field:
@@ -111,7 +181,7 @@ class WhatsAppNotification(Document):
                 ))
 
         if self.set_property_after_alert:
-            meta = frappe.get_meta(self.reference_doctype)
+            meta = self.get_cached_meta(self.reference_doctype)
             if not meta.get_field(self.set_property_after_alert):
                 frappe.throw(_("Field {0} not found on DocType {1}").format(
                     self.set_property_after_alert,
@@ -121,14 +191,12 @@ class WhatsAppNotification(Document):
 
     def send_scheduled_message(self) -> dict:
         """Specific to API endpoint Server Scripts."""
-        safe_exec(
-            self.condition, get_safe_globals(), dict(doc=self)
-        )
+        if self.condition and self.condition.strip():
+            safe_exec(
+                self.condition, get_safe_globals(), dict(doc=self)
+            )
 
-        template = frappe.db.get_value(
-            "WhatsApp Templates", self.template,
-            fieldname='*'
-        )
+        template = frappe.get_cached_doc("WhatsApp Templates", self.template) if self.template else None
 
         if template and template.language_code:
             if self.get("_contact_list"):
@@ -168,15 +236,14 @@ class WhatsAppNotification(Document):
         if self.disabled:
             return
 
-        doc_data = doc.as_dict()
-        if self.condition and not ignore_condition:
+        if self.condition and self.condition.strip() and not ignore_condition:
             # check if condition satisfies
             if not frappe.safe_eval(
-                self.condition, get_safe_globals(), dict(doc=doc_data)
+                self.condition, get_safe_globals(), dict(doc=doc)
             ):
                 return
 
-        template = default_template or frappe.get_doc("WhatsApp Templates", self.template)
+        template = default_template or frappe.get_cached_doc("WhatsApp Templates", self.template)
 
         if template:
             if self.field_name:
@@ -218,77 +285,61 @@ class WhatsAppNotification(Document):
                     frappe.throw(_("Error in Template Data Script: {0}").format(str(e)))
             elif self.fields:
                 parameters = []
+                # Use safe_exec instead of safe_eval to allow frappe module access
+                # Note: RestrictedPython doesn't allow variable names starting with "_"
+                # This allows expressions like frappe.utils.format_date(...) to work
+                _locals_base = {
+                    "doc": doc,
+                    "frappe": _make_frappe_obj(),
+                    "result": None,
+                    # Also add functions directly for convenience
+                    "format_date": format_date,
+                    "format_time": format_time,
+                    "format_datetime": format_datetime,
+                    "get_datetime": get_datetime,
+                    "get_time": get_time,
+                    "now_datetime": now_datetime,
+                    "now": now,
+                }
+                exec_globals = get_safe_globals()
                 for field in self.fields:
                     try:
                         if getattr(field, "field_type", "Field") == "Expression":
                             # Evaluate Python expression
                             if not getattr(field, "expression", None):
                                 frappe.throw(_("Expression is required when Field Type is 'Expression'"))
-                            # Use safe_exec instead of safe_eval to allow frappe module access
-                            # Note: RestrictedPython doesn't allow variable names starting with "_"
-                            # Also, RestrictedPython blocks attribute access on modules, so we need to
-                            # create a utils object that contains commonly used functions
-                            # This allows expressions like frappe.utils.format_date(...) to work
-                            # Create a simple object using type() for attribute access
-                            UtilsObj = type('UtilsObj', (), {
-                                "format_date": format_date,
-                                "format_time": format_time,
-                                "format_datetime": format_datetime,
-                                "get_datetime": get_datetime,
-                                "get_time": get_time,
-                                "now_datetime": now_datetime,
-                                "now": now,
-                                "add_to_date": add_to_date,
-                            })
-                            utils_obj = UtilsObj()
-                            
-                            # Create frappe proxy object
-                            FrappeObj = type('FrappeObj', (), {
-                                "utils": utils_obj,
-                                "db": frappe.db,
-                                "get_doc": frappe.get_doc,
-                                "get_value": frappe.get_value,
-                                "get_list": frappe.get_list,
-                                "session": frappe.session,
-                            })
-                            frappe_obj = FrappeObj()
-                            
-                            _locals = {
-                                "doc": doc,
-                                "frappe": frappe_obj,
-                                "result": None,
-                                # Also add functions directly for convenience
-                                "format_date": format_date,
-                                "format_time": format_time,
-                                "format_datetime": format_datetime,
-                                "get_datetime": get_datetime,
-                                "get_time": get_time,
-                                "now_datetime": now_datetime,
-                                "now": now,
-                            }
-                            safe_exec(f"result = {field.expression}", get_safe_globals(), _locals)
-                            value = _locals.get("result")
+                            code = _compile_expression(field.expression)
+                            _locals = _locals_base.copy()
+                            if code is not None:
+                                value = eval(code, exec_globals, _locals)
+                            else:
+                                safe_exec(f"result = {field.expression}", get_safe_globals(), _locals)
+                                value = _locals.get("result")
                         else:
                             # Use dotted path resolution
                             field_name = getattr(field, "field_name", None)
                             if not field_name:
                                 frappe.throw(_("Field name is required when Field Type is 'Field'"))
                             value = self.get_value_from_path(doc, field_name)
-                            
+
+                            # get_formatted only resolves direct fields; dotted
+                            # paths would fail inside it every time
+                            direct = "." not in field_name
+
                             # Format dates/datetimes if needed
                             if isinstance(value, (datetime.date, datetime.datetime)):
-                                if isinstance(doc, Document):
+                                if isinstance(doc, Document) and direct:
                                     value = doc.get_formatted(field_name)
                                 else:
                                     value = str(value)
-                            elif isinstance(doc, Document) and value is not None:
-                                # Try to get formatted value for other field types
-                                try:
+                            elif isinstance(doc, Document) and value is not None and direct:
+                                # Only date/time/numeric fields format differently
+                                # from their raw value
+                                df = self.get_cached_meta(doc.doctype).get_field(field_name)
+                                if df and df.fieldtype in _FORMATTED_FIELDTYPES:
                                     formatted_value = doc.get_formatted(field_name)
                                     if formatted_value:
                                         value = formatted_value
-                                except Exception:
-                                    pass
                         
                         parameters.append({
                             "type": "text",
@@ -316,50 +367,54 @@ class WhatsAppNotification(Document):
                     "parameters": parameters
                 }]
 
+            if self.attach_document_print or self.custom_attachment:
+                # get_url walks site config; resolve it once per send
+                site_url = frappe.utils.get_url()
+
             if self.attach_document_print:
                 # frappe.db.begin()
                 key = doc.get_document_share_key()  # noqa
                 frappe.db.commit()
                 print_format = "Standard"
-                doctype = frappe.get_doc("DocType", doc_data['doctype'])
-                if doctype.custom:
-                    if doctype.default_print_format:
-                        print_format = doctype.default_print_format
+                meta = self.get_cached_meta(doc.doctype)
+                if meta.custom:
+                    if meta.default_print_format:
+                        print_format = meta.default_print_format
                 else:
                     default_print_format = frappe.db.get_value(
                         "Property Setter",
                         filters={
-                            "doc_type": doc_data['doctype'],
+                            "doc_type": doc.doctype,
                             "property": "default_print_format"
                         },
                         fieldname="value"
                     )
                     print_format = default_print_format if default_print_format else print_format
                 link = get_pdf_link(
-                    doc_data['doctype'],
-                    doc_data['name'],
+                    doc.doctype,
+                    doc.name,
                     print_format=print_format
                 )
 
-                filename = f'{doc_data["name"]}.pdf'
-                url = f'{frappe.utils.get_url()}{link}&key={key}'
+                filename = f'{doc.name}.pdf'
+                url = f'{site_url}{link}&key={key}'
 
             elif self.custom_attachment:
                 filename = self.file_name
 
                 if self.attach_from_field:
-                    file_url = doc_data[self.attach_from_field]
+                    file_url = doc.get(self.attach_from_field)
                     if not file_url.startswith("http"):
                         # get share key so that private files can be sent
                         key = doc.get_document_share_key()
-                        file_url = f'{frappe.utils.get_url()}{file_url}&key={key}'
+                        file_url = f'{site_url}{file_url}&key={key}'
                 else:
                     file_url = self.attach
 
                 if file_url.startswith("http"):
                     url = f'{file_url}'
                 else:
-                    url = f'{frappe.utils.get_url()}{file_url}'
+                    url = f'{site_url}{file_url}'
 
             if template.header_type == 'DOCUMENT':
                 data['template']['components'].append({
@@ -385,44 +440,62 @@ class WhatsAppNotification(Document):
             self.content_type = template.header_type.lower()
 
             if template.buttons:
-                button_fields = self.button_fields.split(",") if self.button_fields else []
-                for idx, btn in enumerate(template.buttons):
-                    if btn.button_type == "Visit Website" and btn.url_type == "Dynamic":
-                        if button_fields:
-                            data['template']['components'].append({
-                                "type": "button",
-                                "sub_type": "url",
-                                "index": str(idx),
-                                "parameters": [
-                                    {"type": "text", "text": doc.get(button_fields.pop(0))}
-                                ]
-                            })
-
-
-            self.notify(data, doc_data, template_account=template.whatsapp_account)
-
-    def notify(self, data, doc_data=None, template_account=None):
+                button_fields = deque(self.button_fields.split(",")) if self.button_fields else deque()
+                for idx, btn in template.dynamic_url_buttons:
+                    if button_fields:
+                        data['template']['components'].append({
+                            "type": "button",
+                            "sub_type": "url",
+                            "index": str(idx),
+                            "parameters": [
+                                {"type": "text", "text": doc.get(button_fields.popleft())}
+                            ]
+                        })
+
+
+            self.notify(data, doc, template_account=template.whatsapp_account)
+
+    def get_cached_account(self, template_account=None):
+        """Memoize the WhatsApp Account doc and decrypted token per notification.
+
+        A daily trigger can push hundreds of messages through one account;
+        resolving the account and token once avoids a DB hit per message.
+        """
+        cache = getattr(self, "_account_cache", None)
+        if cache is None:
+            cache = self._account_cache = {}
+        key = template_account or ""
+        entry = cache.get(key)
+        if entry is None:
+            # Use template's whatsapp account if available, otherwise use default outgoing account
+            if template_account:
+                account = frappe.get_doc("WhatsApp Account", template_account)
+            else:
+                account = get_whatsapp_account(account_type='outgoing')
+            token = account.get_password("token") if account else None
+            entry = cache[key] = (account, token)
+        return entry
+
+    def notify(self, data, doc=None, template_account=None):
         """Notify."""
-        # Use template's whatsapp account if available, otherwise use default outgoing account
-        if template_account:
-            whatsapp_account = frappe.get_doc("WhatsApp Account", template_account)
-        else:
-            whatsapp_account = get_whatsapp_account(account_type='outgoing')
+        whatsapp_account, token = self.get_cached_account(template_account)
 
         if not whatsapp_account:
             frappe.throw(_("Please set a default outgoing WhatsApp Account"))
 
-        token = whatsapp_account.get_password("token")
-
         headers = {
             "authorization": f"Bearer {token}",
             "content-type": "application/json"
         }
         try:
             success = False
-            response = make_post_request(
+            # Store the template on the message log as JSON instead of the
+            # much slower (and unparseable) Python repr.
+            template_json = json.dumps(data['template'], default=str)
+            response = make_whatsapp_request(
+                "POST",
                 f"{whatsapp_account.url}/{whatsapp_account.version}/{whatsapp_account.phone_id}/messages",
-                headers=headers, data=json.dumps(data)
+                headers=headers, data=json.dumps(data, default=str)
             )
 
             if not self.get("content_type"):
@@ -436,7 +509,7 @@ class WhatsAppNotification(Document):
             new_doc = {
                 "doctype": "WhatsApp Message",
                 "type": "Outgoing",
-                "message": str(data['template']),
+                "message": template_json,
                 "to": data['to'],
                 "message_type": "Template",
                 "message_id": response['messages'][0]['id'],
@@ -447,25 +520,32 @@ class WhatsAppNotification(Document):
                 "whatsapp_account": whatsapp_account.name,
             }
 
-            if doc_data:
+            if doc:
                 new_doc.update({
-                    "reference_doctype": doc_data.doctype,
-                    "reference_name": doc_data.name,
+                    "reference_doctype": doc.doctype,
+                    "reference_name": doc.name,
                 })
 
-            frappe.get_doc(new_doc).save(ignore_permissions=True)
+            # Log the sent message from a worker; the insert is bookkeeping
+            # and does not need to block the send path.
+            frappe.enqueue(
+                "frappe_whatsapp.frappe_whatsapp.doctype.whatsapp_notification.whatsapp_notification.create_whatsapp_message_log",
+                message_doc=new_doc,
+                queue="short",
+                enqueue_after_commit=True,
+            )
 
-            if doc_data and self.set_property_after_alert and self.property_value:
-                if doc_data.doctype and doc_data.name:
+            if doc and self.set_property_after_alert and self.property_value:
+                if doc.doctype and doc.name:
                     fieldname = self.set_property_after_alert
                     value = self.property_value
-                    meta = frappe.get_meta(doc_data.get("doctype"))
+                    meta = self.get_cached_meta(doc.doctype)
                     df = meta.get_field(fieldname)
                     if df:
                         if df.fieldtype in frappe.model.numeric_fieldtypes:
                             value = frappe.utils.cint(value)
 
-                        frappe.db.set_value(doc_data.get("doctype"), doc_data.get("name"), fieldname, value)
+                        frappe.db.set_value(doc.doctype, doc.name, fieldname, value)
 
             frappe.msgprint("WhatsApp Message Triggered", indicator="green", alert=True)
             success = True
@@ -501,15 +581,28 @@ class WhatsAppNotification(Document):
 
     def format_number(self, number):
         """Format number."""
-        if (number.startswith("+")):
-            number = number[1:len(number)]
-
-        return number
+        return number.lstrip("+") if number else number
+
+    def needs_full_document(self):
+        """True when sending needs child tables or document APIs that a
+        plain get_all row cannot provide."""
+        if self.attach_document_print or self.custom_attachment:
+            return True
+        if self.template_data_script or self.condition:
+            return True
+        if self.button_fields:
+            return True
+        if self.field_name and "." in self.field_name:
+            return True
+        for field in self.fields:
+            if getattr(field, "field_type", "Field") == "Expression":
+                return True
+            if field.field_name and "." in field.field_name:
+                return True
+        return False
 
     def get_documents_for_today(self):
         """get list of documents that will be triggered today"""
-        docs = []
-
         diff_days = self.days_in_advance
         if self.doctype_event == "Days After":
             diff_days = -diff_days
@@ -518,19 +611,46 @@ class WhatsAppNotification(Document):
         reference_date_start = reference_date + " 00:00:00.000000"
         reference_date_end = reference_date + " 23:59:59.000000"
 
-        doc_list = frappe.get_all(
-            self.reference_doctype,
-            fields="name",
-            filters=[
-                {self.date_changed: (">=", reference_date_start)},
-                {self.date_changed: ("<=", reference_date_end)},
-            ],
+        filters = [
+            {self.date_changed: (">=", reference_date_start)},
+            {self.date_changed: ("<=", reference_date_end)},
+        ]
+
+        names = frappe.get_all(self.reference_doctype, filters=filters, pluck="name")
+
+        # Fan out in chunks so the scheduler tick is not blocked on one
+        # HTTP POST per document, and a bad document only fails its chunk.
+        for start in range(0, len(names), SEND_BATCH_SIZE):
+            frappe.enqueue(
+                "frappe_whatsapp.frappe_whatsapp.doctype.whatsapp_notification.whatsapp_notification.send_scheduled_batch",
+                notification=self.name,
+                docnames=names[start:start + SEND_BATCH_SIZE],
+                queue="long",
+            )
+
+
+def send_scheduled_batch(notification, docnames):
+    """Send one chunk of daily-trigger documents. Runs in a background worker."""
+    alert = frappe.get_doc("WhatsApp Notification", notification)
+
+    if alert.needs_full_document():
+        for name in docnames:
+            alert.send_template_message(frappe.get_doc(alert.reference_doctype, name))
+    else:
+        # Single query instead of one get_doc per row; the notification
+        # only reads top-level fields, so hydrate documents from the rows.
+        rows = frappe.get_all(
+            alert.reference_doctype,
+            fields=["*"],
+            filters={"name": ("in", docnames)},
         )
+        for row in rows:
+            alert.send_template_message(frappe.get_doc(dict(row, doctype=alert.reference_doctype)))
 
-        for d in doc_list:
-            doc = frappe.get_doc(self.reference_doctype, d.name)
-            self.send_template_message(doc)
-            # print(doc.name)
+
+def create_whatsapp_message_log(message_doc):
+    """Insert the outgoing WhatsApp Message log. Runs in a background worker."""
+    frappe.get_doc(message_doc).insert(ignore_permissions=True)
 
 
 @frappe.whitelist()
@@ -5,33 +5,128 @@
 import os
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from urllib.parse import quote
+
 import frappe
 import magic
 from frappe import _
 from frappe.model.document import Document
-from frappe.integrations.utils import make_post_request, make_request
 from frappe.desk.form.utils import get_pdf_link
 
-from frappe_whatsapp.utils import get_whatsapp_account
+from frappe_whatsapp.utils import (
+    get_account_token,
+    get_http_session,
+    get_whatsapp_account,
+    make_whatsapp_request,
+)
+
+# Patterns used on every template save; precompiled so the hot validation
+# path skips the re module cache lookup.
+_TEMPLATE_NAME_RE = re.compile(r'^[a-z][a-z0-9_]*$')
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9_]')
+_NON_ALNUM_STRIP_RE = re.compile(r'[^a-z0-9]')
+_DUP_UNDERSCORE_RE = re.compile(r'_+')
+_PARAM_RE = re.compile(r'\{\{(\d+)\}\}')
+
+# Common separators mapped to underscore in one translate pass
+_SEPS_TRANS = str.maketrans({c: '_' for c in ' -.\t\n\r'})
+
+@lru_cache(maxsize=128)
+def _split_example_urls(example_url):
+    """Split a comma-separated example URL string, cached across saves."""
+    return tuple(url.strip() for url in example_url.split(","))
+
+
+def _build_url_button(btn, b):
+    b["type"] = "URL"
+    b["url"] = btn.website_url
+    if btn.url_type == "Dynamic" and btn.example_url:
+        b["example"] = list(_split_example_urls(btn.example_url))
+
+
+def _build_phone_button(btn, b):
+    b["type"] = "PHONE_NUMBER"
+    b["phone_number"] = btn.phone_number
+
+
+def _build_quick_reply_button(btn, b):
+    b["type"] = "QUICK_REPLY"
+
+
+# Fields whose change makes the validation/update work below necessary;
+# saves touching none of these (status syncs, flag toggles) skip it
+_VALIDATED_FIELDS = (
+    "template", "template_name", "language", "header_type", "sample",
+    "footer", "header", "category", "sample_values",
+)
+
+
+def _buttons_snapshot(doc):
+    """Comparable view of the button rows that feed the Meta payload."""
+    return [
+        (d.button_type, d.button_label, d.phone_number, d.website_url,
+         d.url_type, d.example_url)
+        for d in (doc.get("buttons") or [])
+    ]
+
+# One dict lookup per button instead of an if/elif chain
+_BUTTON_BUILDERS = {
+    "Visit Website": _build_url_button,
+    "Call Phone": _build_phone_button,
+    "Quick Reply": _build_quick_reply_button,
+}
+
+
+# One libmagic instance for mime sniffing; constructing magic.Magic loads
+# the magic database, which is far too expensive to redo per upload.
+try:
+    _MIME = magic.Magic(mime=True)
+except Exception:
+    _MIME = None
+
 
 class WhatsAppTemplates(Document):
     """Create whatsapp template."""
 
+    @cached_property
+    def dynamic_url_buttons(self):
+        """(index, button) pairs for Visit Website buttons with dynamic URLs."""
+        return [
+            (idx, btn) for idx, btn in enumerate(self.buttons)
+            if btn.button_type == "Visit Website" and btn.url_type == "Dynamic"
+        ]
+
+    def _template_definition_changed(self):
+        """Whether any field that feeds the Meta payload changed in this save."""
+        if any(self.has_value_changed(field) for field in _VALIDATED_FIELDS):
+            return True
+        # has_value_changed cannot cover a child table; diff the buttons
+        # against the pre-save snapshot
+        before = self.get_doc_before_save()
+        if before is None:
+            return True
+        return _buttons_snapshot(self) != _buttons_snapshot(before)
+
     def validate(self):
         self.set_whatsapp_account()
+        if not self.is_new() and not self._template_definition_changed():
+            return
         if not self.language_code or self.has_value_changed("language"):
-            lang_code = frappe.db.get_value("Language", self.language) or "en"
+            lang_code = frappe.db.get_value("Language", self.language, cache=True) or "en"
             self.language_code = lang_code.replace("-", "_")
 
         # Sanitize and validate template name
         if self.template_name:
             sanitized = self.sanitize_template_name(self.template_name)
-            if sanitized != self.template_name.lower().replace(" ", "_"):
+            simple = self.template_name.lower().replace(" ", "_")
+            if sanitized != simple:
                 # Auto-sanitize the actual_name that will be used
-                if not self.actual_name or self.actual_name == self.template_name.lower().replace(" ", "_"):
+                if not self.actual_name or self.actual_name == simple:
                     self.actual_name = sanitized
             # Validate the sanitized name
-            if not re.match(r'^[a-z][a-z0-9_]*$', sanitized):
+            if not _TEMPLATE_NAME_RE.match(sanitized):
                 frappe.throw(
                     _("Template name '{0}' contains invalid characters. "
                       "Template names can only contain lowercase letters, numbers, and underscores, "
@@ -101,7 +196,9 @@ class WhatsAppTemplates(Document):
 
         # Check if template has parameters and validate sample_values
         if self.template:
-            param_count = self.get_parameter_count()
+            # Cache for after_insert/update_template; the body does not
+            # change between validate and those hooks
+            param_count = self._param_count = self.get_parameter_count()
             if param_count > 0:
                 if not self.sample_values:
                     frappe.throw(
@@ -112,8 +209,9 @@ class WhatsAppTemplates(Document):
                         title=_("Sample Values Required")
                     )
                 else:
-                    # Parse sample_values - try JSON first, then pipe, then comma
-                    sample_list = self._parse_sample_values(self.sample_values, param_count)
+                    # Parse sample_values - try JSON first, then pipe, then comma.
+                    # Cached so after_insert/update_template reuse the parse.
+                    sample_list = self._sample_list = self._parse_sample_values(self.sample_values, param_count)
                     if len(sample_list) != param_count:
                         frappe.throw(
                             _("Sample Values count ({0}) does not match template parameter count ({1}). "
@@ -144,34 +242,110 @@ class WhatsAppTemplates(Document):
         """Sanitize template name to only contain lowercase letters, numbers, and underscores."""
         if not name:
             return ""
-        # Convert to lowercase
-        sanitized = name.lower()
-        # Replace spaces, hyphens, and other common separators with underscores
-        sanitized = re.sub(r'[\s\-\.]+', '_', sanitized)
+        # Lowercase and map common separators to underscores in one pass
+        sanitized = name.lower().translate(_SEPS_TRANS)
         # Remove any characters that aren't lowercase letters, numbers, or underscores
-        sanitized = re.sub(r'[^a-z0-9_]', '', sanitized)
-        # Remove consecutive underscores
-        sanitized = re.sub(r'_+', '_', sanitized)
-        # Remove leading/trailing underscores
-        sanitized = sanitized.strip('_')
+        sanitized = _NON_ALNUM_RE.sub('', sanitized)
+        # Collapse consecutive underscores and strip leading/trailing ones
+        sanitized = _DUP_UNDERSCORE_RE.sub('_', sanitized).strip('_')
         # Ensure it doesn't start with a number (WhatsApp requirement)
         if sanitized and sanitized[0].isdigit():
             sanitized = '_' + sanitized
         # Ensure it's not empty
         if not sanitized:
-            sanitized = 'template_' + re.sub(r'[^a-z0-9]', '', name.lower())[:20]
+            sanitized = 'template_' + _NON_ALNUM_STRIP_RE.sub('', name.lower())[:20]
         return sanitized
 
     def get_parameter_count(self):
         """Count the number of parameters in the template ({{1}}, {{2}}, etc.)."""
-        if not self.template:
-            return 0
-        # Find all parameter placeholders like {{1}}, {{2}}, etc.
-        matches = re.findall(r'\{\{(\d+)\}\}', self.template)
-        if not matches:
+        # C-level substring check short-circuits the regex walk for the
+        # common parameterless template
+        if not self.template or '{{' not in self.template:
             return 0
-        # Return the highest parameter number found
-        return max(int(m) for m in matches)
+        # Return the highest parameter number found; single pass, no
+        # intermediate match list
+        highest = 0
+        for match in _PARAM_RE.finditer(self.template):
+            number = int(match.group(1))
+            if number > highest:
+                highest = number
+        return highest
+
+    def _build_components(self, strict_samples=True):
+        """Build the components payload shared by template create and update.
+
+        strict_samples controls the sample-count mismatch behaviour: create
+        throws, update pads or truncates to the parameter count.
+        """
+        components = []
+
+        body = {
+            "type": "body",
+            "text": self._normalize_template_text(),
+        }
+        # WhatsApp API requires example field when template has parameters
+        param_count = getattr(self, "_param_count", None)
+        if param_count is None:
+            param_count = self.get_parameter_count()
+        if param_count > 0:
+            if self.sample_values:
+                # Reuse the list parsed in validate when available
+                sample_list = getattr(self, "_sample_list", None)
+                if sample_list is None:
+                    sample_list = self._parse_sample_values(self.sample_values, param_count)
+                if strict_samples:
+                    if len(sample_list) != param_count:
+                        frappe.throw(
+                            _("Sample Values count ({0}) does not match template parameter count ({1}). "
+                              "Please provide exactly {1} values.").format(
+                                len(sample_list), param_count
+                            ),
+                            title=_("Sample Values Mismatch")
+                        )
+                    # Validate character limits for each sample value
+                    self._validate_sample_value_lengths(sample_list)
+                elif len(sample_list) < param_count:
+                    # Pad with "Sample" if not enough values (copy so the
+                    # cached list is not mutated)
+                    sample_list = sample_list + ["Sample"] * (param_count - len(sample_list))
+                elif len(sample_list) > param_count:
+                    # Truncate if too many values
+                    sample_list = sample_list[:param_count]
+            else:
+                # Auto-generate sample values if missing (shouldn't happen due to validation)
+                sample_list = [f"Sample {i}" for i in range(1, param_count + 1)]
+            body["example"] = {"body_text": [sample_list]}
+        components.append(body)
+
+        if self.header_type:
+            components.append(self.get_header())
+
+        if self.footer:
+            components.append({"type": "footer", "text": self.footer})
+
+        if self.buttons:
+            button_block = {"type": "buttons", "buttons": []}
+            for btn in self.buttons:
+                b = {"type": btn.button_type, "text": btn.button_label}
+
+                builder = _BUTTON_BUILDERS.get(btn.button_type)
+                if builder:
+                    builder(btn, b)
+
+                button_block["buttons"].append(b)
+
+            components.append(button_block)
+
+        return components
+
+    def _normalize_template_text(self):
+        """Normalize newlines: CRLF/CR to LF, and strip trailing newlines."""
+        text = self.template or ""
+        # Most templates contain no carriage returns; skip both replace
+        # passes entirely in that case
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text.rstrip("\n")
 
     def _parse_sample_values(self, sample_values_str, expected_count=None):
         """Parse sample_values string into a list.
@@ -202,14 +376,13 @@ class WhatsAppTemplates(Document):
             except (json.JSONDecodeError, ValueError):
                 pass
         
-        # Try pipe-separated format (good for values with commas)
-        if "|" in sample_values_str:
-            sample_list = [s.strip() for s in sample_values_str.split("|") if s.strip()]
-            if expected_count is None or len(sample_list) == expected_count:
-                return sample_list
-        
-        # Fall back to comma-separated (default, but breaks if values contain commas)
-        sample_list = [s.strip() for s in sample_values_str.split(",") if s.strip()]
+        # Single classification pass: pipe wins when present (good for values
+        # with commas), else comma
+        sep = "|" if "|" in sample_values_str else ","
+        sample_list = [s.strip() for s in sample_values_str.split(sep) if s.strip()]
+        if sep == "|" and expected_count is not None and len(sample_list) != expected_count:
+            # Fall back to comma-separated when the pipe count doesn't match
+            sample_list = [s.strip() for s in sample_values_str.split(",") if s.strip()]
         return sample_list
 
     def _validate_sample_value_lengths(self, sample_list):
@@ -226,11 +399,18 @@ class WhatsAppTemplates(Document):
         BODY_PARAM_LIMIT = 1000  # Conservative limit for template approval
         HEADER_PARAM_LIMIT = 60
         
+        # Parameter indices referenced by a TEXT header, computed once
+        # instead of a substring scan per sample value
+        if self.header_type == "TEXT" and self.header:
+            header_params = {int(m) for m in _PARAM_RE.findall(self.header)}
+        else:
+            header_params = set()
+
         for idx, value in enumerate(sample_list, start=1):
             value_len = len(value)
-            
+
             # Check if this parameter is used in header
-            header_has_param = self.header_type == "TEXT" and self.header and f"{{{{{idx}}}}}" in self.header
+            header_has_param = idx in header_params
             
             if header_has_param:
                 if value_len > HEADER_PARAM_LIMIT:
@@ -265,7 +445,7 @@ class WhatsAppTemplates(Document):
         """Upload media."""
         self.get_settings()
         file_path = self.get_absolute_path(self.sample)
-        mime = magic.Magic(mime=True)
+        mime = _MIME or magic.Magic(mime=True)
         file_type = mime.from_file(file_path)
 
         payload = {
@@ -274,10 +454,11 @@ class WhatsAppTemplates(Document):
             'messaging_product': 'whatsapp'
         }
 
-        response = make_post_request(
+        response = make_whatsapp_request(
+            "POST",
             f"{self._url}/{self._version}/{self._app_id}/uploads",
             headers=self._headers,
-            data=json.loads(json.dumps(payload))
+            data=payload
         )
         self._session_id = response['id']
 
@@ -288,15 +469,15 @@ class WhatsAppTemplates(Document):
                 "authorization": f"OAuth {self._token}"
             }
         file_name = self.get_absolute_path(self.sample)
+        # Pass the handle so requests streams the upload in chunks instead
+        # of buffering the whole file in memory
         with open(file_name, mode='rb') as file: # b is important -> binary
-            file_content = file.read()
-
-        payload = file_content
-        response = make_post_request(
-            f"{self._url}/{self._version}/{self._session_id}",
-            headers=headers,
-            data=payload
-        )
+            response = make_whatsapp_request(
+                "POST",
+                f"{self._url}/{self._version}/{self._session_id}",
+                headers=headers,
+                data=file
+            )
 
         self._media_id = response['h']
 
@@ -340,118 +521,47 @@ class WhatsAppTemplates(Document):
             "name": self.actual_name,
             "language": self.language_code,
             "category": self.category,
-            "components": [],
+            "components": self._build_components(),
         }
 
-        # Normalize newlines: convert \r\n to \n, remove trailing newlines
-        template_text = self.template.replace('\r\n', '\n').replace('\r', '\n') if self.template else ""
-        template_text = template_text.rstrip('\n\r')
-        
-        body = {
-            "type": "body",
-            "text": template_text,
-        }
-        # WhatsApp API requires example field when template has parameters
-        param_count = self.get_parameter_count()
-        if param_count > 0:
-            if self.sample_values:
-                # Parse sample_values using smart parser (supports JSON, pipe, comma)
-                sample_list = self._parse_sample_values(self.sample_values, param_count)
-                # Validate count matches
-                if len(sample_list) != param_count:
-                    frappe.throw(
-                        _("Sample Values count ({0}) does not match template parameter count ({1}). "
-                          "Please provide exactly {1} values.").format(
-                            len(sample_list), param_count
-                        ),
-                        title=_("Sample Values Mismatch")
-                    )
-                # Validate character limits for each sample value
-                self._validate_sample_value_lengths(sample_list)
-                body.update({"example": {"body_text": [sample_list]}})
-            else:
-                # Auto-generate sample values if missing (shouldn't happen due to validation)
-                sample_list = [f"Sample {i}" for i in range(1, param_count + 1)]
-                body.update({"example": {"body_text": [sample_list]}})
-
-        data["components"].append(body)
-        if self.header_type:
-            data["components"].append(self.get_header())
-
-        # add footer
-        if self.footer:
-            data["components"].append({"type": "footer", "text": self.footer})
-
-        # add buttons
-        if self.buttons:
-            button_block = {"type": "buttons", "buttons": []}
-            for btn in self.buttons:
-                b = {"type": btn.button_type, "text": btn.button_label}
-
-                if btn.button_type == "Visit Website":
-                    b["type"] = "URL"
-                    b["url"] = btn.website_url
-                    if btn.url_type == "Dynamic" and btn.example_url:
-                        b["example"] = btn.example_url.split(",")
-                elif btn.button_type == "Call Phone":
-                    b["type"] = "PHONE_NUMBER"
-                    b["phone_number"] = btn.phone_number
-                elif btn.button_type == "Quick Reply":
-                    b["type"] = "QUICK_REPLY"
-
-                button_block["buttons"].append(b)
-
-            data["components"].append(button_block)
-
+        # Serialize once; the error paths below log the same payload
+        payload = json.dumps(data)
         try:
-            response = make_post_request(
-                f"{self._url}/{self._version}/{self._business_id}/message_templates",
+            response = make_whatsapp_request(
+                "POST",
+                self._templates_url,
                 headers=self._headers,
-                data=json.dumps(data),
+                data=payload,
             )
             self.id = response["id"]
             self.status = response["status"]
             self.db_update()
         except Exception as e:
-            # Get full error response for debugging
-            error_details = {}
             error_message = str(e)
             error_title = "Error"
-            
+            response_text = ""
+
             # Try to get error from integration_request flag (set by make_request before raise_for_status)
-            if hasattr(frappe.flags, 'integration_request') and frappe.flags.integration_request:
+            integration_request = getattr(frappe.flags, 'integration_request', None)
+            if integration_request is not None:
                 try:
-                    error_response = frappe.flags.integration_request.json()
+                    error_response = integration_request.json()
                     error_details = error_response.get("error", {})
                     error_message = error_details.get("error_user_msg") or error_details.get("message") or error_message
                     error_title = error_details.get("error_user_title", "Error")
-                    
-                    # Log full error for debugging
-                    frappe.log_error(
-                        f"WhatsApp Template Creation Error:\nRequest Data: {json.dumps(data, indent=2)}\n\nAPI Response: {json.dumps(error_response, indent=2)}",
-                        "WhatsApp Template API Error"
-                    )
-                except Exception as parse_error:
-                    # If JSON parsing fails, try to get text response
-                    try:
-                        error_text = frappe.flags.integration_request.text
-                        frappe.log_error(
-                            f"WhatsApp Template Creation Error (text response):\nRequest Data: {json.dumps(data, indent=2)}\n\nAPI Response Text: {error_text}\nParse Error: {str(parse_error)}",
-                            "WhatsApp Template API Error"
-                        )
-                        error_message = f"{error_message}\n\nAPI Response: {error_text[:500]}"
-                    except Exception:
-                        frappe.log_error(
-                            f"Error accessing API response: {str(parse_error)}\nOriginal error: {str(e)}\nRequest Data: {json.dumps(data, indent=2)}",
-                            "WhatsApp Template API Error"
-                        )
-            else:
-                # If integration_request is not available, log the exception
-                frappe.log_error(
-                    f"WhatsApp Template Creation Error (no integration_request): {str(e)}\nRequest Data: {json.dumps(data, indent=2)}",
-                    "WhatsApp Template API Error"
-                )
-            
+                    response_text = json.dumps(error_response)
+                except Exception:
+                    # Response was not valid JSON; fall back to the raw text
+                    response_text = getattr(integration_request, "text", "")
+                    if response_text:
+                        error_message = f"{error_message}\n\nAPI Response: {response_text[:500]}"
+
+            # One consolidated log row, request payload unindented
+            frappe.log_error(
+                f"WhatsApp Template Creation Error: {error_message}\nRequest Data: {payload}\nAPI Response: {response_text}",
+                "WhatsApp Template API Error"
+            )
+
             frappe.throw(
                 msg=error_message,
                 title=error_title,
@@ -460,12 +570,12 @@ class WhatsAppTemplates(Document):
     def _check_template_exists_on_whatsapp(self):
         """Check if template with same name and language already exists on WhatsApp."""
         try:
-            response = make_request(
+            response = make_whatsapp_request(
                 "GET",
-                f"{self._url}/{self._version}/{self._business_id}/message_templates?name={self.actual_name}",
+                f"{self._templates_url}?name={quote(self.actual_name)}",
                 headers=self._headers,
             )
-            
+
             for template in response.get("data", []):
                 # Match by name and language
                 if template.get("name") == self.actual_name and template.get("language") == self.language_code:
@@ -493,12 +603,12 @@ class WhatsAppTemplates(Document):
         """Sync status for template that was imported with existing ID."""
         try:
             self.get_settings()
-            response = make_request(
+            response = make_whatsapp_request(
                 "GET",
-                f"{self._url}/{self._version}/{self._business_id}/message_templates?name={self.actual_name}",
+                f"{self._templates_url}?name={quote(self.actual_name)}",
                 headers=self._headers,
             )
-            
+
             for template in response.get("data", []):
                 if template.get("id") == self.id or template.get("name") == self.actual_name:
                     self.status = template.get("status", self.status)
@@ -524,65 +634,15 @@ class WhatsAppTemplates(Document):
     def update_template(self):
         """Update template to meta."""
         self.get_settings()
-        data = {"components": []}
-
-        # Normalize newlines: convert \r\n to \n, remove trailing newlines
-        template_text = self.template.replace('\r\n', '\n').replace('\r', '\n') if self.template else ""
-        template_text = template_text.rstrip('\n\r')
-        
-        body = {
-            "type": "body",
-            "text": template_text,
-        }
-        # WhatsApp API requires example field when template has parameters
-        param_count = self.get_parameter_count()
-        if param_count > 0:
-            if self.sample_values:
-                # Parse sample_values using smart parser (supports JSON, pipe, comma)
-                sample_list = self._parse_sample_values(self.sample_values, param_count)
-                # Ensure we have exactly the right number of sample values
-                if len(sample_list) < param_count:
-                    # Pad with "Sample" if not enough values
-                    sample_list.extend(["Sample"] * (param_count - len(sample_list)))
-                elif len(sample_list) > param_count:
-                    # Truncate if too many values
-                    sample_list = sample_list[:param_count]
-                body.update({"example": {"body_text": [sample_list]}})
-            else:
-                # Auto-generate sample values if missing (shouldn't happen due to validation)
-                sample_list = [f"Sample {i}" for i in range(1, param_count + 1)]
-                body.update({"example": {"body_text": [sample_list]}})
-        data["components"].append(body)
-        if self.header_type:
-            data["components"].append(self.get_header())
-        if self.footer:
-            data["components"].append({"type": "footer", "text": self.footer})
-        if self.buttons:
-            button_block = {"type": "buttons", "buttons": []}
-            for btn in self.buttons:
-                b = {"type": btn.button_type, "text": btn.button_label}
-
-                if btn.button_type == "Visit Website":
-                    b["type"] = "URL"
-                    b["url"] = btn.website_url
-                    if btn.url_type == "Dynamic" and btn.example_url:
-                        b["example"] = btn.example_url.split(",")
-                elif btn.button_type == "Call Phone":
-                    b["type"] = "PHONE_NUMBER"
-                    b["phone_number"] = btn.phone_number
-                elif btn.button_type == "Quick Reply":
-                    b["type"] = "QUICK_REPLY"
-
-                button_block["buttons"].append(b)
-
-            data["components"].append(button_block)
+        data = {"components": self._build_components(strict_samples=False)}
 
         try:
             # Update template - WhatsApp API requires business_id in the URL
             # Note: WhatsApp typically doesn't allow updating templates once they're submitted
             # This will only work for templates that haven't been submitted yet
-            make_post_request(
-                f"{self._url}/{self._version}/{self._business_id}/{self.id}",
+            make_whatsapp_request(
+                "POST",
+                f"{self._api_base}/{self.id}",
                 headers=self._headers,
                 data=json.dumps(data),
             )
@@ -641,8 +701,13 @@ class WhatsAppTemplates(Document):
 
     def get_settings(self):
         """Get whatsapp settings."""
-        settings = frappe.get_doc("WhatsApp Account", self.whatsapp_account)
-        self._token = settings.get_password("token")
+        # get_session_id, get_media_id and the API hooks all call this in a
+        # single save flow; load the account once per document instance
+        if getattr(self, "_settings_loaded", False):
+            return
+
+        settings = frappe.get_cached_doc("WhatsApp Account", self.whatsapp_account)
+        self._token = get_account_token(self.whatsapp_account)
         self._url = settings.url
         self._version = settings.version
         self._business_id = settings.business_id
@@ -652,12 +717,17 @@ class WhatsAppTemplates(Document):
             "authorization": f"Bearer {self._token}",
             "content-type": "application/json",
         }
+        # Every API hook below hits one of these two prefixes; build them
+        # once instead of re-interpolating per call
+        self._api_base = f"{self._url}/{self._version}/{self._business_id}"
+        self._templates_url = f"{self._api_base}/message_templates"
+        self._settings_loaded = True
 
     def on_trash(self):
         self.get_settings()
-        url = f"{self._url}/{self._version}/{self._business_id}/message_templates?name={self.actual_name}"
+        url = f"{self._templates_url}?name={quote(self.actual_name)}"
         try:
-            make_request("DELETE", url, headers=self._headers)
+            make_whatsapp_request("DELETE", url, headers=self._headers)
         except Exception:
             res = frappe.flags.integration_request.json().get("error", {})
             if res.get("error_user_title") == "Message Template Not Found":
@@ -701,8 +771,8 @@ def sync_template_status(template_name):
             frappe.throw(_("WhatsApp Account is not set for this template."))
         
         # Get settings
-        settings = frappe.get_doc("WhatsApp Account", doc.whatsapp_account)
-        token = settings.get_password("token")
+        settings = frappe.get_cached_doc("WhatsApp Account", doc.whatsapp_account)
+        token = get_account_token(doc.whatsapp_account)
         url = settings.url
         version = settings.version
         business_id = settings.business_id
@@ -713,9 +783,9 @@ def sync_template_status(template_name):
         }
         
         # Fetch template from WhatsApp API
-        response = make_request(
+        response = make_whatsapp_request(
             "GET",
-            f"{url}/{version}/{business_id}/message_templates?name={doc.actual_name}",
+            f"{url}/{version}/{business_id}/message_templates?name={quote(doc.actual_name)}",
             headers=headers,
         )
         
@@ -732,12 +802,13 @@ def sync_template_status(template_name):
         # Update status
         old_status = doc.status
         new_status = template_found.get("status", "PENDING")
-        
-        doc.status = new_status
-        doc.save(ignore_permissions=True)
-        
-        frappe.db.commit()
-        
+
+        if old_status != new_status:
+            # One UPDATE; running the full save pipeline for a
+            # single-column status change just fires hooks for nothing
+            frappe.db.set_value("WhatsApp Templates", doc.name, "status", new_status)
+            frappe.db.commit()
+
         if old_status != new_status:
             return {
                 "message": _("Template status updated from '{0}' to '{1}'").format(old_status, new_status),
@@ -755,136 +826,217 @@ def sync_template_status(template_name):
         frappe.log_error(f"Error syncing template status: {str(e)}", "WhatsApp Template Sync")
         frappe.throw(_("Failed to sync template status: {0}").format(str(e)))
 
+_BUTTON_TYPE_MAP = {
+    "URL": "Visit Website",
+    "PHONE_NUMBER": "Call Phone",
+    "QUICK_REPLY": "Quick Reply"
+}
+
+
+def _apply_header_component(doc, component):
+    doc.header_type = component["format"]
+    # if format is text update sample text
+    if component["format"] == "TEXT":
+        doc.header = component["text"]
+
+
+def _apply_footer_component(doc, component):
+    doc.footer = component["text"]
+
+
+def _apply_body_component(doc, component):
+    doc.template = component["text"]
+    example = component.get("example")
+    # Check if 'body_text' exists before trying to access it
+    if example and example.get("body_text"):
+        doc.sample_values = ",".join(example["body_text"][0])
+
+
+def _apply_buttons_component(doc, component):
+    # Only clear in memory; upsert_doc_without_hooks deletes the stored
+    # child rows before re-inserting, so a second DELETE here is wasted
+    doc.set("buttons", [])
+    for i, button in enumerate(component.get("buttons", []), start=1):
+        btn = {}
+        btn["button_type"] = _BUTTON_TYPE_MAP[button["type"]]
+        btn["button_label"] = button.get("text")
+        btn["sequence"] = i
+
+        if button["type"] == "URL":
+            btn["website_url"] = button.get("url")
+            if "{{" in btn["website_url"]:
+                btn["url_type"] = "Dynamic"
+            else:
+                btn["url_type"] = "Static"
+
+            if button.get("example"):
+                btn["example_url"] = ",".join(button["example"])
+        elif button["type"] == "PHONE_NUMBER":
+            btn["phone_number"] = button.get("phone_number")
+
+        doc.append("buttons", btn)
+
+
+# Component appliers used when syncing templates down from Meta
+_COMPONENT_HANDLERS = {
+    "HEADER": _apply_header_component,
+    "FOOTER": _apply_footer_component,
+    "BODY": _apply_body_component,
+    "BUTTONS": _apply_buttons_component,
+}
+
+
+def _fetch_account_templates(account, headers):
+    """Fetch one account's template catalog from Meta.
+
+    Requests only the fields the sync reads and follows paging.next so
+    large catalogs arrive in bounded pages instead of one giant body.
+    Runs on a worker thread, so it uses the pooled session directly and
+    must not touch frappe.local.
+    """
+    session = get_http_session()
+    url = (
+        f"{account.url}/{account.version}/{account.business_id}/message_templates"
+        "?fields=name,status,language,category,id,components&limit=200"
+    )
+    data = []
+    while url:
+        response = session.get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+        payload = response.json()
+        data.extend(payload.get("data", []))
+        url = payload.get("paging", {}).get("next")
+    return data
+
+
+def _extract_response_error(error):
+    """Pull Meta's error message out of a requests exception, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        res = response.json().get("error", {})
+    except ValueError:
+        return None
+    return res.get("error_user_msg") or res.get("message")
+
+
 @frappe.whitelist()
 def fetch():
     """Fetch templates from meta."""
     """Later improve this code to pass a whatsapp account remove the js funcation so that it is called from whatsapp account doctype """
     whatsapp_accounts = frappe.get_all('WhatsApp Account', filters={'status': 'Active'}, fields=['name', 'token', 'url', 'version', 'business_id'])
+    if not whatsapp_accounts:
+        return "Successfully fetched templates from meta"
 
+    # Tokens come from the database; resolve them before fanning out so
+    # the worker threads only do HTTP
+    jobs = []
     for account in whatsapp_accounts:
-        # get credentials
-        token = frappe.get_doc("WhatsApp Account", account.name).get_password("token")
-        url = account.url
-        version = account.version
-        business_id = account.business_id
+        token = get_account_token(account.name)
+        jobs.append((account, {"authorization": f"Bearer {token}", "content-type": "application/json"}))
+
+    # Each call is network-bound; overlap them so fetch wall-time is the
+    # slowest account instead of the sum of all accounts
+    results, failures = [], []
+    with ThreadPoolExecutor(max_workers=min(8, len(jobs))) as executor:
+        futures = {
+            executor.submit(_fetch_account_templates, account, headers): account
+            for account, headers in jobs
+        }
+        for future, account in futures.items():
+            try:
+                results.append((account, future.result()))
+            except Exception as e:
+                failures.append((account, e))
+
+    # One SELECT for the whole catalog instead of a get_value per
+    # template returned by Meta
+    existing_names = {
+        row.actual_name: row.name
+        for row in frappe.get_all(
+            "WhatsApp Templates", fields=["name", "actual_name"]
+        )
+    }
 
-        headers = {"authorization": f"Bearer {token}", "content-type": "application/json"}
+    for account, templates in results:
+        for template in templates:
+            # Find existing template by actual_name
+            existing_template = existing_names.get(template["name"])
 
-        try:
-            response = make_request(
-                "GET",
-                f"{url}/{version}/{business_id}/message_templates",
-                headers=headers,
+            if existing_template:
+                doc = frappe.get_doc("WhatsApp Templates", existing_template)
+            else:
+                doc = frappe.new_doc("WhatsApp Templates")
+                doc.template_name = template["name"]
+                doc.actual_name = template["name"]
+
+            # Update status and other fields
+            old_status = doc.status
+            doc.status = template["status"]
+            doc.language_code = template["language"]
+            doc.category = template["category"]
+            doc.id = template["id"]
+            doc.whatsapp_account = account.name
+
+            # update components
+            for component in template["components"]:
+                handler = _COMPONENT_HANDLERS.get(component["type"])
+                if handler:
+                    handler(doc, component)
+
+            upsert_doc_without_hooks(
+                doc, "WhatsApp Button", "buttons",
+                is_new=existing_template is None,
             )
+            existing_names[doc.actual_name] = doc.name
 
-            for template in response["data"]:
-                # Find existing template by actual_name or id
-                existing_template = frappe.db.get_value(
-                    "WhatsApp Templates",
-                    filters={"actual_name": template["name"]},
-                    fieldname="name"
-                )
-                
-                if existing_template:
-                    doc = frappe.get_doc("WhatsApp Templates", existing_template)
-                else:
-                    doc = frappe.new_doc("WhatsApp Templates")
-                    doc.template_name = template["name"]
-                    doc.actual_name = template["name"]
-
-                # Update status and other fields
-                old_status = doc.status
-                doc.status = template["status"]
-                doc.language_code = template["language"]
-                doc.category = template["category"]
-                doc.id = template["id"]
-                doc.whatsapp_account = account.name
-
-                # update components
-                for component in template["components"]:
-
-                    # update header
-                    if component["type"] == "HEADER":
-                        doc.header_type = component["format"]
-
-                        # if format is text update sample text
-                        if component["format"] == "TEXT":
-                            doc.header = component["text"]
-                    # Update footer text
-                    elif component["type"] == "FOOTER":
-                        doc.footer = component["text"]
-
-                    # update template text
-                    elif component["type"] == "BODY":
-                        doc.template = component["text"]
-                        if component.get("example"):
-    			            # Check if 'body_text' exists before trying to access it
-                            if component["example"].get("body_text"):
-                                doc.sample_values = ",".join(
-            	                    component["example"]["body_text"][0]
-                    	        )
-
-                    # Update buttons
-                    elif component["type"] == "BUTTONS":
-                        doc.set("buttons", [])
-                        frappe.db.delete("WhatsApp Button", {"parent": doc.name, "parenttype": "WhatsApp Templates"})
-                        typeMap = {
-                            "URL": "Visit Website",
-                            "PHONE_NUMBER": "Call Phone",
-                            "QUICK_REPLY": "Quick Reply"
-                        }
-
-                        for i, button in enumerate(component.get("buttons", []), start=1):
-                            btn = {}
-                            btn["button_type"] = typeMap[button["type"]]
-                            btn["button_label"] = button.get("text")
-                            btn["sequence"] = i
-
-                            if button["type"] == "URL":
-                                btn["website_url"] = button.get("url")
-                                if "{{" in btn["website_url"]:
-                                    btn["url_type"] = "Dynamic"
-                                else:
-                                    btn["url_type"] = "Static"
-
-                                if button.get("example"):
-                                    btn["example_url"] = ",".join(button["example"])
-                            elif button["type"] == "PHONE_NUMBER":
-                                btn["phone_number"] = button.get("phone_number")
-
-                            doc.append("buttons", btn)
-
-                upsert_doc_without_hooks(doc, "WhatsApp Button", "buttons")
-
-            return "Successfully fetched templates from meta"
+    # One commit for the whole sync; committing per template forced an
+    # fsync each iteration
+    frappe.db.commit()
 
-        except Exception as e:
-            # Check if frappe.flags.integration_request is set and has a .json() method
-            if hasattr(frappe.flags.integration_request, 'json'):
-                try:
-                    res = frappe.flags.integration_request.json().get("error", {})
-                    error_message = res.get("error_user_msg", res.get("message"))
-                    frappe.throw(
-                        msg=error_message,
-                        title=res.get("error_user_title", "Error"),
-                    )
-                except (json.JSONDecodeError, KeyError):
-                    # Handle cases where the response is not valid JSON or lacks the 'error' key
-                    frappe.throw(f"An unexpected error occurred while fetching templates: {e}")
-            else:
-                # Handle cases where frappe.flags.integration_request doesn't exist or isn't a proper response object
-                frappe.throw(f"An unexpected server error occurred: {e}")
+    if failures:
+        account, error = failures[0]
+        error_message = _extract_response_error(error)
+        if error_message:
+            frappe.throw(msg=error_message, title="Error")
+        else:
+            frappe.throw(f"An unexpected error occurred while fetching templates: {error}")
+
+    return "Successfully fetched templates from meta"
+
+def upsert_doc_without_hooks(doc, child_dt, child_field, is_new=None):
+    """Insert or update a parent document and its children without hooks.
 
-def upsert_doc_without_hooks(doc, child_dt, child_field):
-    """Insert or update a parent document and its children without hooks."""
-    if frappe.db.exists(doc.doctype, doc.name):
+    Callers that already know whether the parent exists (fetch keeps an
+    in-memory name map) pass is_new to skip the exists query.
+    """
+    if is_new is None:
+        is_new = not frappe.db.exists(doc.doctype, doc.name)
+    if not is_new:
         doc.db_update()
         frappe.db.delete(child_dt, {"parent": doc.name, "parenttype": doc.doctype})
     else:
         doc.db_insert()
-    for d in doc.get(child_field):
-        d.parent = doc.name
-        d.parenttype = doc.doctype
-        d.parentfield = child_field
-        d.db_insert()
-    frappe.db.commit()
+
+    children = doc.get(child_field)
+    if children:
+        # One multi-row INSERT for the children instead of a round-trip
+        # per row
+        now = frappe.utils.now()
+        user = frappe.session.user
+        columns = children[0].get_valid_columns()
+        values = []
+        for idx, d in enumerate(children, start=1):
+            d.name = d.name or frappe.generate_hash(length=10)
+            d.parent = doc.name
+            d.parenttype = doc.doctype
+            d.parentfield = child_field
+            d.idx = idx
+            d.owner = d.owner or user
+            d.modified_by = user
+            d.creation = d.creation or now
+            d.modified = now
+            valid = d.get_valid_dict(convert_dates_to_str=True)
+            values.append([valid.get(column) for column in columns])
+        frappe.db.bulk_insert(child_dt, columns, values)
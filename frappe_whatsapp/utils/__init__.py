@@ -1,8 +1,42 @@
 """Run on each event."""
+import requests
+from requests.adapters import HTTPAdapter
+
 import frappe
 
 from frappe.core.doctype.server_script.server_script_utils import EVENT_MAP
 
+_http_session = None
+
+
+def get_http_session():
+    """Shared keep-alive session for WhatsApp API calls.
+
+    Reusing one pooled session amortizes the TCP/TLS handshake across the
+    many requests a batch trigger makes to the same Meta host.
+    """
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+
+def make_whatsapp_request(method, url, headers=None, data=None):
+    """Drop-in for frappe's make_request that reuses the pooled session.
+
+    Keeps the frappe.flags.integration_request contract that error
+    handlers across this app rely on.
+    """
+    response = frappe.flags.integration_request = get_http_session().request(
+        method, url, headers=headers, data=data, timeout=30
+    )
+    response.raise_for_status()
+    return response.json()
+
 
 def run_server_script_for_doc_event(doc, event):
     """Run on each event."""
@@ -121,23 +155,49 @@ def trigger_whatsapp_notifications(event):
             wa.name,
         ).send_scheduled_message()
 
+def get_account_token(account_name):
+    """Decrypted token for a WhatsApp Account, memoized per request.
+
+    get_password reads __Auth and runs a decrypt on every call; webhooks
+    and batch sends resolve the same account repeatedly, so the result
+    is kept on frappe.local, which resets with the request.
+    """
+    cache = getattr(frappe.local, "whatsapp_token_cache", None)
+    if cache is None:
+        cache = frappe.local.whatsapp_token_cache = {}
+    token = cache.get(account_name)
+    if token is None:
+        token = cache[account_name] = frappe.get_cached_doc(
+            "WhatsApp Account", account_name
+        ).get_password("token")
+    return token
+
+
 def get_whatsapp_account(phone_id=None, account_type='incoming'):
     """map whatsapp account with message"""
+    # Accounts change rarely while webhooks resolve the same phone_id
+    # thousands of times; cache the name lookups in redis (invalidated
+    # from WhatsApp Account's on_update) and serve cached docs
     if phone_id:
-        account_name = frappe.db.get_value('WhatsApp Account', {'phone_id': phone_id}, 'name')
+        account_name = frappe.cache().hget(
+            "whatsapp_account_by_phone",
+            phone_id,
+            generator=lambda: frappe.db.get_value('WhatsApp Account', {'phone_id': phone_id}, 'name'),
+        )
         if account_name:
-            return frappe.get_doc("WhatsApp Account", account_name)
+            return frappe.get_cached_doc("WhatsApp Account", account_name)
 
-    account_field_type = 'is_default_incoming' if account_type =='incoming' else 'is_default_outgoing' 
-    default_account_name = frappe.db.get_value('WhatsApp Account', {account_field_type: 1}, 'name')
+    account_field_type = 'is_default_incoming' if account_type =='incoming' else 'is_default_outgoing'
+    default_account_name = frappe.cache().hget(
+        "whatsapp_account_by_phone",
+        account_field_type,
+        generator=lambda: frappe.db.get_value('WhatsApp Account', {account_field_type: 1}, 'name'),
+    )
     if default_account_name:
-        return frappe.get_doc("WhatsApp Account", default_account_name)
+        return frappe.get_cached_doc("WhatsApp Account", default_account_name)
 
     return None
 
 def format_number(number):
     """Format number."""
-    if number.startswith("+"):
-        number = number[1 : len(number)]
-
-    return number
\ No newline at end of file
+    return number.lstrip("+") if number else number
\ No newline at end of file
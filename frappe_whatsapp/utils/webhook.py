@@ -1,12 +1,87 @@
 """Webhook."""
 import frappe
 import json
-import requests
+import logging
 import time
 from werkzeug.wrappers import Response
 import frappe.utils
 
-from frappe_whatsapp.utils import get_whatsapp_account
+from frappe_whatsapp.utils import (
+	format_number,
+	get_account_token,
+	get_http_session,
+	get_whatsapp_account,
+	run_server_script_for_doc_event,
+)
+
+# Columns written by the webhook bulk insert; everything else keeps its
+# database default
+_MESSAGE_INSERT_FIELDS = [
+	"name", "creation", "modified", "owner", "modified_by", "docstatus",
+	"type", "from", "message", "message_id", "reply_to_message_id",
+	"is_reply", "content_type", "profile_name", "whatsapp_account",
+]
+
+# Media types are handled out of band: they need a stub document before
+# the download job can be enqueued
+_MEDIA_TYPES = {"image", "audio", "video", "document"}
+
+
+def _text_fields(message, is_reply, reply_to_message_id):
+	return {
+		"message": message['text']['body'],
+		"message_id": message['id'],
+		"reply_to_message_id": reply_to_message_id,
+		"is_reply": is_reply,
+		"content_type": "text",
+	}
+
+
+def _reaction_fields(message, is_reply, reply_to_message_id):
+	return {
+		"message": message['reaction']['emoji'],
+		"reply_to_message_id": message['reaction']['message_id'],
+		"message_id": message['id'],
+		"content_type": "reaction",
+	}
+
+
+def _flow_fields(message, is_reply, reply_to_message_id):
+	return {
+		"message": message['interactive']['nfm_reply']['response_json'],
+		"message_id": message['id'],
+		"reply_to_message_id": reply_to_message_id,
+		"is_reply": is_reply,
+		"content_type": "flow",
+	}
+
+
+def _button_fields(message, is_reply, reply_to_message_id):
+	return {
+		"message": message['button']['text'],
+		"message_id": message['id'],
+		"reply_to_message_id": reply_to_message_id,
+		"is_reply": is_reply,
+		"content_type": "button",
+	}
+
+
+def _default_fields(message, is_reply, reply_to_message_id):
+	message_type = message['type']
+	return {
+		"message_id": message['id'],
+		"message": message[message_type].get(message_type),
+		"content_type": message_type,
+	}
+
+
+# Type-specific field builders; one dict lookup replaces the elif ladder
+_MESSAGE_FIELD_BUILDERS = {
+	"text": _text_fields,
+	"reaction": _reaction_fields,
+	"interactive": _flow_fields,
+	"button": _button_fields,
+}
 
 
 @frappe.whitelist(allow_guest=True)
@@ -34,25 +109,28 @@ def get():
 def post():
 	"""Post."""
 	data = frappe.local.form_dict
-	frappe.get_doc({
-		"doctype": "WhatsApp Notification Log",
-		"template": "Webhook",
-		"meta_data": json.dumps(data)
-	}).insert(ignore_permissions=True)
+	# Log on a worker; status pings are the bulk of webhook traffic and
+	# should not pay for an INSERT on the request path
+	frappe.enqueue(
+		"frappe_whatsapp.utils.webhook.log_webhook",
+		data=data,
+		queue="short",
+	)
 
-	messages = []
-	phone_id = None
-	try:
-		messages = data["entry"][0]["changes"][0]["value"].get("messages", [])
-		phone_id = data.get("entry", [{}])[0].get("changes", [{}])[0].get("value", {}).get("metadata", {}).get("phone_number_id")
-	except KeyError:
-		messages = data["entry"]["changes"][0]["value"].get("messages", [])
+	# Walk entry -> changes -> value once; every branch below reads from
+	# these locals instead of re-traversing the payload
+	entry = data.get("entry")
+	first_entry = entry[0] if isinstance(entry, list) and entry else (entry or {})
+	changes = first_entry.get("changes") or [{}]
+	change = changes[0]
+	value = change.get("value") or {}
+
+	messages = value.get("messages", [])
+	phone_id = value.get("metadata", {}).get("phone_number_id")
 	sender_profile_name = next(
 		(
 			contact.get("profile", {}).get("name")
-			for entry in data.get("entry", [])
-			for change in entry.get("changes", [])
-			for contact in change.get("value", {}).get("contacts", [])
+			for contact in value.get("contacts", [])
 		),
 		None,
 	)
@@ -62,151 +140,188 @@ def post():
 		return
 
 	if messages:
+		rows = []
 		for message in messages:
 			message_type = message['type']
 			is_reply = True if message.get('context') and 'forwarded' not in message.get('context') else False
 			reply_to_message_id = message['context']['id'] if is_reply else None
-			if message_type == 'text':
-				frappe.get_doc({
+			if message_type in _MEDIA_TYPES:
+				# Insert a stub right away and download the binary on a
+				# worker so the webhook is not blocked on Meta's CDN
+				message_doc = frappe.get_doc({
 					"doctype": "WhatsApp Message",
 					"type": "Incoming",
 					"from": message['from'],
-					"message": message['text']['body'],
 					"message_id": message['id'],
 					"reply_to_message_id": reply_to_message_id,
 					"is_reply": is_reply,
-					"content_type":message_type,
-					"profile_name":sender_profile_name,
-					"whatsapp_account":whatsapp_account.name
-				}).insert(ignore_permissions=True)
-			elif message_type == 'reaction':
-				frappe.get_doc({
-					"doctype": "WhatsApp Message",
-					"type": "Incoming",
-					"from": message['from'],
-					"message": message['reaction']['emoji'],
-					"reply_to_message_id": message['reaction']['message_id'],
-					"message_id": message['id'],
-					"content_type": "reaction",
-					"profile_name":sender_profile_name,
-					"whatsapp_account":whatsapp_account.name
-				}).insert(ignore_permissions=True)
-			elif message_type == 'interactive':
-				frappe.get_doc({
-					"doctype": "WhatsApp Message",
-					"type": "Incoming",
-					"from": message['from'],
-					"message": message['interactive']['nfm_reply']['response_json'],
-					"message_id": message['id'],
-					"reply_to_message_id": reply_to_message_id,
-					"is_reply": is_reply,
-					"content_type": "flow",
-					"profile_name":sender_profile_name,
-					"whatsapp_account":whatsapp_account.name
-				}).insert(ignore_permissions=True)
-			elif message_type in ["image", "audio", "video", "document"]:
-				token = whatsapp_account.get_password("token")
-				url = f"{whatsapp_account.url}/{whatsapp_account.version}/"
-
-				media_id = message[message_type]["id"]
-				headers = {
-					'Authorization': 'Bearer ' + token
-
-				}
-				response = requests.get(f'{url}{media_id}/', headers=headers)
-
-				if response.status_code == 200:
-					media_data = response.json()
-					media_url = media_data.get("url")
-					mime_type = media_data.get("mime_type")
-					file_extension = mime_type.split('/')[1]
-
-					media_response = requests.get(media_url, headers=headers)
-					if media_response.status_code == 200:
-
-						file_data = media_response.content
-						file_name = f"{frappe.generate_hash(length=10)}.{file_extension}"
-
-						message_doc = frappe.get_doc({
-							"doctype": "WhatsApp Message",
-							"type": "Incoming",
-							"from": message['from'],
-							"message_id": message['id'],
-							"reply_to_message_id": reply_to_message_id,
-							"is_reply": is_reply,
-							"message": message[message_type].get("caption",f"/files/{file_name}"),
-							"content_type" : message_type,
-							"profile_name":sender_profile_name,
-							"whatsapp_account":whatsapp_account.name
-						}).insert(ignore_permissions=True)
-
-						file = frappe.get_doc(
-							{
-								"doctype": "File",
-								"file_name": file_name,
-								"attached_to_doctype": "WhatsApp Message",
-								"attached_to_name": message_doc.name,
-								"content": file_data,
-								"attached_to_field": "attach"
-							}
-						).save(ignore_permissions=True)
-
-
-						message_doc.attach = file.file_url
-						message_doc.save()
-			elif message_type == "button":
-				frappe.get_doc({
-					"doctype": "WhatsApp Message",
-					"type": "Incoming",
-					"from": message['from'],
-					"message": message['button']['text'],
-					"message_id": message['id'],
-					"reply_to_message_id": reply_to_message_id,
-					"is_reply": is_reply,
-					"content_type": message_type,
-					"profile_name":sender_profile_name,
-					"whatsapp_account":whatsapp_account.name
-				}).insert(ignore_permissions=True)
-			else:
-				frappe.get_doc({
-					"doctype": "WhatsApp Message",
-					"type": "Incoming",
-					"from": message['from'],
-					"message_id": message['id'],
-					"message": message[message_type].get(message_type),
+					"message": message[message_type].get("caption", ""),
 					"content_type" : message_type,
 					"profile_name":sender_profile_name,
 					"whatsapp_account":whatsapp_account.name
 				}).insert(ignore_permissions=True)
 
+				frappe.enqueue(
+					"frappe_whatsapp.utils.webhook.download_media",
+					message_doc_name=message_doc.name,
+					media_id=message[message_type]["id"],
+					whatsapp_account_name=whatsapp_account.name,
+					has_caption=bool(message[message_type].get("caption")),
+					queue="short",
+					enqueue_after_commit=True,
+				)
+				continue
+
+			builder = _MESSAGE_FIELD_BUILDERS.get(message_type, _default_fields)
+			rows.append({
+				"type": "Incoming",
+				"from": message['from'],
+				"profile_name": sender_profile_name,
+				"whatsapp_account": whatsapp_account.name,
+				**builder(message, is_reply, reply_to_message_id),
+			})
+
+		if rows:
+			_insert_message_batch(rows)
+
 	else:
-		changes = None
-		try:
-			changes = data["entry"][0]["changes"][0]
-		except (KeyError, IndexError, TypeError):
-			try:
-				changes = data["entry"]["changes"][0]
-			except (KeyError, IndexError, TypeError):
-				frappe.log_error("Webhook structure error", f"Unable to parse webhook changes. Data: {json.dumps(data)}")
-				return
-		if changes:
-			update_status(changes)
+		if change:
+			update_status(change)
+		else:
+			frappe.log_error("Webhook structure error", f"Unable to parse webhook changes. Data: {json.dumps(data)}")
 	return
 
+def log_webhook(data):
+	"""Persist the raw webhook payload off the request path."""
+	frappe.get_doc({
+		"doctype": "WhatsApp Notification Log",
+		"template": "Webhook",
+		"meta_data": json.dumps(data)
+	}).insert(ignore_permissions=True)
+
+
+def _insert_message_batch(rows):
+	"""Insert incoming messages with one multi-row statement.
+
+	Meta can deliver dozens of messages per webhook; going through the
+	full controller pipeline per message is the hot path. The side
+	effects that pipeline carried for incoming messages — WhatsApp
+	Profiles bookkeeping and the wildcard doc-event dispatch that powers
+	DocType Event notifications (auto-replies) — are replicated below.
+	"""
+	now = frappe.utils.now()
+	user = frappe.session.user
+	docs = []
+	values = []
+	for row in rows:
+		name = frappe.generate_hash(length=10)
+		values.append([
+			name, now, now, user, user, 0,
+			row["type"], row.get("from"), row.get("message"),
+			row.get("message_id"), row.get("reply_to_message_id"),
+			int(bool(row.get("is_reply"))), row.get("content_type"),
+			row.get("profile_name"), row.get("whatsapp_account"),
+		])
+		docs.append(frappe.get_doc(dict(row, doctype="WhatsApp Message", name=name)))
+	frappe.db.bulk_insert("WhatsApp Message", _MESSAGE_INSERT_FIELDS, values)
+	_sync_profiles(rows)
+
+	# The per-doc insert used to fire the wildcard doc_events hook; run
+	# the same insert-time events so configured notifications still see
+	# these messages
+	for doc in docs:
+		for event in ("before_validate", "validate", "before_insert", "after_insert", "on_update"):
+			run_server_script_for_doc_event(doc, event)
+
+
+def _sync_profiles(rows):
+	"""Create missing WhatsApp Profiles and refresh profile names in batch."""
+	numbers = {format_number(row["from"]) for row in rows if row.get("from")}
+	if not numbers:
+		return
+
+	existing = set(frappe.get_all(
+		"WhatsApp Profiles", filters={"number": ("in", list(numbers))}, pluck="number"
+	))
+	for row in rows:
+		if not row.get("from"):
+			continue
+		number = format_number(row["from"])
+		profile_name = row.get("profile_name")
+		if number not in existing:
+			frappe.get_doc({
+				"doctype": "WhatsApp Profiles",
+				"profile_name": profile_name,
+				"number": number,
+				"whatsapp_account": row.get("whatsapp_account"),
+			}).insert(ignore_permissions=True)
+			existing.add(number)
+		elif profile_name:
+			profile_id = frappe.get_value("WhatsApp Profiles", {"number": number}, "name")
+			frappe.db.set_value("WhatsApp Profiles", profile_id, "profile_name", profile_name)
+
+
+def download_media(message_doc_name, media_id, whatsapp_account_name, has_caption=True):
+	"""Fetch a media binary from Meta and attach it to the stub message."""
+	whatsapp_account = frappe.get_cached_doc("WhatsApp Account", whatsapp_account_name)
+	token = get_account_token(whatsapp_account_name)
+	url = f"{whatsapp_account.url}/{whatsapp_account.version}/"
+
+	headers = {
+		'Authorization': 'Bearer ' + token
+	}
+	session = get_http_session()
+	response = session.get(f'{url}{media_id}/', headers=headers, timeout=(5, 30))
+	if response.status_code != 200:
+		frappe.log_error("WhatsApp media download error", f"Media metadata request failed with {response.status_code} for {media_id}")
+		return
+
+	media_data = response.json()
+	media_url = media_data.get("url")
+	mime_type = media_data.get("mime_type")
+	file_extension = mime_type.split('/')[1]
+
+	media_response = session.get(media_url, headers=headers, timeout=(5, 30))
+	if media_response.status_code != 200:
+		frappe.log_error("WhatsApp media download error", f"Media download failed with {media_response.status_code} for {media_id}")
+		return
+
+	file_name = f"{frappe.generate_hash(length=10)}.{file_extension}"
+	file = frappe.get_doc(
+		{
+			"doctype": "File",
+			"file_name": file_name,
+			"attached_to_doctype": "WhatsApp Message",
+			"attached_to_name": message_doc_name,
+			"content": media_response.content,
+			"attached_to_field": "attach"
+		}
+	).save(ignore_permissions=True)
+
+	values = {"attach": file.file_url}
+	if not has_caption:
+		values["message"] = file.file_url
+	frappe.db.set_value("WhatsApp Message", message_doc_name, values, update_modified=False)
+
+
 def update_status(data):
 	"""Update status hook."""
 	if not data:
 		return
 		
 	field = data.get("field")
-	
-	# Log all status updates for debugging
-	frappe.logger().info(f"Webhook status update received - Field: {field}, Data: {json.dumps(data)}")
-	
+
+	# Log all status updates for debugging; only pay for the JSON dump
+	# when the logger is actually emitting
+	logger = frappe.logger()
+	if logger.isEnabledFor(logging.INFO):
+		logger.info(f"Webhook status update received - Field: {field}, Data: {json.dumps(data)}")
+
 	if field == "message_template_status_update":
 		value = data.get('value')
 		if value:
-			frappe.logger().info(f"Processing template status update: {json.dumps(value)}")
+			if logger.isEnabledFor(logging.INFO):
+				logger.info(f"Processing template status update: {json.dumps(value)}")
 			update_template_status(value)
 		else:
 			frappe.log_error("Webhook template status error", f"Missing value in template status update. Data: {json.dumps(data)}")
@@ -219,7 +334,8 @@ def update_status(data):
 			frappe.log_error("Webhook message status error", f"Missing value in message status update. Data: {json.dumps(data)}")
 	else:
 		# Log unknown field types for debugging
-		frappe.logger().debug(f"Unknown webhook field: {field}. Data: {json.dumps(data)}")
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug(f"Unknown webhook field: {field}. Data: {json.dumps(data)}")
 
 def update_template_status(data):
 	"""
@@ -254,59 +370,45 @@ def update_template_status(data):
 		# Normalize status value (Meta sends uppercase like "APPROVED", "REJECTED")
 		# but database might store in different case
 		status = str(event).upper()
-		
-		# Check if template exists
-		template_exists = frappe.db.exists("WhatsApp Templates", {"id": message_template_id})
-		
-		if not template_exists:
-			# Try to find by actual_name as fallback
-			template_name = data.get("message_template_name")
-			if template_name:
-				template_exists = frappe.db.exists("WhatsApp Templates", {"actual_name": template_name})
-				if template_exists:
-					template_doc = frappe.get_doc("WhatsApp Templates", {"actual_name": template_name})
-					# Update the id if it was missing
-					if not template_doc.id:
-						template_doc.id = message_template_id
-						template_doc.save(ignore_permissions=True)
-					frappe.db.sql(
-						"""UPDATE `tabWhatsApp Templates`
-						SET status = %s
-						WHERE actual_name = %s""",
-						(status, template_name)
-					)
-					frappe.db.commit()
-					frappe.logger().info(f"Updated template {template_name} (id: {message_template_id}) status to {status}")
-					return
-		
-		if not template_exists:
-			frappe.log_error("Template status update error", 
-				f"Template not found. ID: {message_template_id}, Name: {data.get('message_template_name')}, Data: {json.dumps(data)}")
-			return
-		
-		# Update template status by ID
+
+		# One statement covers both lookup paths: match by id when we have
+		# it, fall back to actual_name, and backfill a missing id
 		frappe.db.sql(
 			"""UPDATE `tabWhatsApp Templates`
-			SET status = %s
-			WHERE id = %s""",
-			(status, message_template_id)
+			SET status = %s, id = COALESCE(id, %s), modified = NOW(6)
+			WHERE id = %s OR actual_name = %s""",
+			(status, message_template_id, message_template_id, data.get("message_template_name"))
 		)
+
+		if not frappe.db.sql("SELECT ROW_COUNT()")[0][0]:
+			frappe.log_error("Template status update error",
+				f"Template not found. ID: {message_template_id}, Name: {data.get('message_template_name')}, Data: {json.dumps(data)}")
+			return
+
 		frappe.db.commit()
-		
-		frappe.logger().info(f"Updated template {message_template_id} status to {status}")
+
+		logger = frappe.logger()
+		if logger.isEnabledFor(logging.INFO):
+			logger.info(f"Updated template {message_template_id} status to {status}")
 	except Exception as e:
 		frappe.log_error("Template status update error", 
 			f"Error updating template status: {str(e)}\nData: {json.dumps(data)}\nTraceback: {frappe.get_traceback()}")
 
 def update_message_status(data):
 	"""Update message status."""
-	id = data['statuses'][0]['id']
-	status = data['statuses'][0]['status']
-	conversation = data['statuses'][0].get('conversation', {}).get('id')
-	name = frappe.db.get_value("WhatsApp Message", filters={"message_id": id})
-
-	doc = frappe.get_doc("WhatsApp Message", name)
-	doc.status = status
-	if conversation:
-		doc.conversation_id = conversation
-	doc.save(ignore_permissions=True)
+	status_entry = data['statuses'][0]
+	id = status_entry['id']
+	status = status_entry['status']
+	conversation = status_entry.get('conversation', {}).get('id')
+
+	# Meta sends several status callbacks per outbound message; a single
+	# UPDATE skips the document load and save pipeline, and is a no-op
+	# for unknown message ids
+	frappe.db.sql(
+		"""UPDATE `tabWhatsApp Message`
+		SET status = %s,
+			conversation_id = COALESCE(%s, conversation_id),
+			modified = NOW(6)
+		WHERE message_id = %s""",
+		(status, conversation, id),
+	)